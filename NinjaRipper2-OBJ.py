@@ -1,26 +1,64 @@
+import io
 import os
+import mmap
 import sys
 import struct
 import argparse
+import numpy as np
 from pathlib import Path
+from collections import defaultdict
+from multiprocessing import Pool
+
+_MAGIC = struct.Struct('<II')   # magic, version
+_HDR = struct.Struct('<III')    # chunk size, tag, index
+_COUNTS = struct.Struct('<II')  # VERT/INDX payload prefix: count, vertex size/topology
+
+_FORMAT_BLOCK_ROWS = 1 << 16  # Rows formatted per % operation, bounds the temporary strings
+
+def _write_rows(out, fmt, rows):
+    """Write every row of a 2D array to out with fmt, one % operation per block of rows"""
+    block_fmt = (fmt + "\n") * _FORMAT_BLOCK_ROWS
+    for start in range(0, len(rows), _FORMAT_BLOCK_ROWS):
+        block = rows[start:start + _FORMAT_BLOCK_ROWS]
+        if len(block) < _FORMAT_BLOCK_ROWS:
+            block_fmt = (fmt + "\n") * len(block)
+        out.write((block_fmt % tuple(block.ravel().tolist())).encode())
 
 class NR2ObjConverter:
     def __init__(self):
         self.chunks = []
+        self._by_tag = defaultdict(list)  # Chunks grouped by tag, filled alongside self.chunks
         self.nr_version = 0
+        self._mm = None  # Backing buffer for chunk data, kept alive until conversion finishes
+        self._nr_file_path = None
+        self._vert_chunks = ()
+        self._verts = [None, None]  # Local and World space vertices, parsed on first use
+        self._indices = None
+        self._faces = None
+        
+    def reset(self):
+        """Drop all state from the previous file so the converter can be reused"""
+        self.chunks.clear()
+        self._by_tag.clear()
+        self._mm = None
+        self._nr_file_path = None
+        self._vert_chunks = ()
+        self._verts[:] = [None, None]
+        self._indices = None
+        self._faces = None
         
     def read_nr_file(self, file_path):
         """Read and parse a NinjaRipper 2 .nr file based on the nrfile.py structure"""
+        # Map the file instead of reading it, chunk data is paged in on demand
         with open(file_path, 'rb') as f:
-            data = f.read()
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(self._mm)
         
-        # Check magic number
-        magic = struct.unpack('<I', data[0:4])[0]
+        # Check magic number and version
+        magic, self.nr_version = _MAGIC.unpack_from(mv, 0)
         if magic != 0x5049524E:  # 'NRIP' in little-endian
             raise ValueError("Not a valid NinjaRipper 2 file (missing NRIP magic)")
         
-        # Get version
-        self.nr_version = struct.unpack('<I', data[4:8])[0]
         if self.nr_version > 3:
             print(f"Warning: Unsupported version {self.nr_version}, trying to continue anyway")
         
@@ -28,52 +66,48 @@ class NR2ObjConverter:
         pos = 16  # Start after header (magic(4) + version(4) + reserved(8))
         
         # Parse chunks
-        while pos < len(data):
-            if pos + 12 > len(data):
+        while pos < len(mv):
+            if pos + 12 > len(mv):
                 break
                 
             # Read chunk header (12 bytes)
-            raw_size = struct.unpack('<I', data[pos:pos+4])[0]
-            tag = struct.unpack('<I', data[pos+4:pos+8])[0]
-            idx = struct.unpack('<I', data[pos+8:pos+12])[0]
+            raw_size, tag, idx = _HDR.unpack_from(mv, pos)
             
-            # Extract chunk data
-            chunk_data = data[pos+12:pos+raw_size] if raw_size > 12 else b''
+            # Extract chunk data (memoryview slices share the file buffer, no copy)
+            chunk_data = mv[pos+12:pos+raw_size] if raw_size > 12 else b''
             
             # Store chunk info
-            self.chunks.append((tag, idx, pos, raw_size, chunk_data))
+            chunk = (tag, idx, pos, raw_size, chunk_data)
+            self.chunks.append(chunk)
+            self._by_tag[tag].append(chunk)
             
             # Move to next chunk
             pos += raw_size
             
     def tag_to_string(self, tag):
         """Convert a tag integer to string representation"""
-        return "".join([chr((tag >> (8 * i)) & 0xFF) for i in range(4)])
+        return tag.to_bytes(4, 'little').decode('latin-1')
     
     def find_chunks(self, tag):
         """Find all chunks of a specific type"""
-        return [chunk for chunk in self.chunks if chunk[0] == tag]
+        return self._by_tag.get(tag, ())
     
     def parse_vertex_data(self, vert_data):
         """Parse vertex data from VERT chunk based on nrfile.py structure"""
         # VERT chunk structure: vertex count (4 bytes), vertex size (4 bytes), then vertex data
         if len(vert_data) < 8:
-            return []
+            raise ValueError(f"VERT chunk too short: {len(vert_data)} bytes, header needs 8")
             
-        vertex_count = struct.unpack('<I', vert_data[0:4])[0]
-        vertex_size = struct.unpack('<I', vert_data[4:8])[0]
-        
-        vertices = []
-        pos = 8  # Start of vertex data
+        vertex_count, vertex_size = _COUNTS.unpack_from(vert_data, 0)
+        if vertex_size < 12:
+            raise ValueError(f"VERT chunk vertex size {vertex_size} is smaller than a position (12 bytes)")
+        if len(vert_data) < 8 + vertex_count * vertex_size:
+            raise ValueError(f"VERT chunk truncated: {vertex_count} vertices of {vertex_size} bytes "
+                             f"need {8 + vertex_count * vertex_size} bytes, got {len(vert_data)}")
         
-        for i in range(vertex_count):
-            if pos + 12 > len(vert_data):
-                break
-                
-            # Read position (3 floats, 12 bytes)
-            x, y, z = struct.unpack('<fff', vert_data[pos:pos+12])
-            vertices.append((x, y, z))
-            pos += vertex_size  # Move to next vertex
+        # Strided view over the position (3 floats, first 12 bytes) of each vertex
+        vertex_dtype = np.dtype({'names': ['p'], 'formats': [('<f4', 3)], 'itemsize': vertex_size})
+        vertices = np.frombuffer(vert_data, dtype=vertex_dtype, count=vertex_count, offset=8)['p']
             
         return vertices
     
@@ -81,35 +115,30 @@ class NR2ObjConverter:
         """Parse index data from INDX chunk based on nrfile.py structure"""
         # INDX chunk structure: index count (4 bytes), topology (4 bytes), then index data
         if len(indx_data) < 8:
-            return []
+            raise ValueError(f"INDX chunk too short: {len(indx_data)} bytes, header needs 8")
             
-        index_count = struct.unpack('<I', indx_data[0:4])[0]
+        index_count, _ = _COUNTS.unpack_from(indx_data, 0)
+        if len(indx_data) < 8 + index_count * 4:
+            raise ValueError(f"INDX chunk truncated: {index_count} indices "
+                             f"need {8 + index_count * 4} bytes, got {len(indx_data)}")
         
-        indices = []
-        pos = 8  # Start of index data
-        
-        for i in range(index_count):
-            if pos + 4 > len(indx_data):
-                break
-                
-            # Read index (4 bytes)
-            index = struct.unpack('<I', indx_data[pos:pos+4])[0]
-            indices.append(index)
-            pos += 4
+        indices = np.frombuffer(indx_data, dtype='<u4', count=index_count, offset=8)
             
         return indices
     
-    def convert_to_obj(self, nr_file_path, obj_file_path, use_world_space=True):
-        """Convert .nr file to .obj file"""
+    def load(self, nr_file_path, verbose=False):
+        """Read a .nr file and parse its vertex and index data for emit_obj"""
         try:
-            self.chunks = []  # Reset chunks for each conversion
+            self.reset()  # Reset state left from the previous file
             self.read_nr_file(nr_file_path)
+            self._nr_file_path = nr_file_path
             
             # Debug: print all found chunks
-            print(f"Found {len(self.chunks)} chunks:")
-            for i, (tag, idx, pos, size, data) in enumerate(self.chunks):
-                tag_str = self.tag_to_string(tag)
-                print(f"  {i}: {tag_str} (idx={idx}, pos={pos}, size={size})")
+            if verbose:
+                print(f"Found {len(self.chunks)} chunks:")
+                for i, (tag, idx, pos, size, data) in enumerate(self.chunks):
+                    tag_str = self.tag_to_string(tag)
+                    print(f"  {i}: {tag_str} (idx={idx}, pos={pos}, size={size})")
             
             # Find relevant chunks
             vert_chunks = self.find_chunks(0x54524556)  # 'VERT' in little-endian
@@ -120,37 +149,53 @@ class NR2ObjConverter:
             if not vert_chunks or not indx_chunks:
                 raise ValueError("No vertex or index data found in file")
             
+            # Vertices are parsed by emit_obj, so a bad chunk only fails its own space
+            self._vert_chunks = vert_chunks
+            
+            # Use the first index chunk (usually the same for both spaces)
+            self._indices = self.parse_index_data(indx_chunks[0][4])
+            
+            # Group indices into triangles once, dropping any trailing partial face
+            # OBJ indices are 1-based, widen first so 0xFFFFFFFF does not wrap to 0
+            face_count = len(self._indices) // 3
+            self._faces = self._indices[:face_count * 3].reshape(face_count, 3).astype(np.int64) + 1
+            
+        except Exception as e:
+            print(f"Error loading file: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        
+        return True
+    
+    def emit_obj(self, obj_file_path, use_world_space=True):
+        """Write the loaded mesh to an .obj file in Local or World space"""
+        try:
             # Determine which vertex chunk to use
             # Typically first is local space, second is world space
-            vert_chunk_idx = 1 if use_world_space and len(vert_chunks) > 1 else 0
-            vert_chunk = vert_chunks[vert_chunk_idx]
+            space = 1 if use_world_space and len(self._vert_chunks) > 1 else 0
+            if self._verts[space] is None:
+                self._verts[space] = self.parse_vertex_data(self._vert_chunks[space][4])
+            vertices = self._verts[space]
+            faces = self._faces
             
-            # Use the first index chunk (usually the same for both spaces)
-            indx_chunk = indx_chunks[0]
+            # Format the whole OBJ in memory, then write it out in one go
+            buf = io.BytesIO()
+            buf.write(b"# Converted from NinjaRipper 2 .nr file\n")
+            buf.write(f"# Original file: {os.path.basename(self._nr_file_path)}\n".encode())
+            buf.write(f"# Vertex space: {'World' if use_world_space else 'Local'}\n\n".encode())
             
-            # Parse vertices and indices
-            vertices = self.parse_vertex_data(vert_chunk[4])
-            indices = self.parse_index_data(indx_chunk[4])
+            # Write vertices
+            _write_rows(buf, 'v %.6f %.6f %.6f', vertices)
             
-            # Write to OBJ file
-            with open(obj_file_path, 'w') as obj_file:
-                obj_file.write(f"# Converted from NinjaRipper 2 .nr file\n")
-                obj_file.write(f"# Original file: {os.path.basename(nr_file_path)}\n")
-                obj_file.write(f"# Vertex space: {'World' if use_world_space else 'Local'}\n\n")
-                
-                # Write vertices
-                for v in vertices:
-                    obj_file.write(f"v {v[0]:.6f} {v[1]:.6f} {v[2]:.6f}\n")
-                
-                # Write faces (assuming triangles)
-                obj_file.write("\n")
-                for i in range(0, len(indices), 3):
-                    if i + 2 < len(indices):
-                        # OBJ indices are 1-based
-                        obj_file.write(f"f {indices[i]+1} {indices[i+1]+1} {indices[i+2]+1}\n")
+            # Write faces (assuming triangles)
+            buf.write(b"\n")
+            _write_rows(buf, 'f %d %d %d', faces)
+            
+            Path(obj_file_path).write_bytes(buf.getbuffer())
             
-            print(f"Successfully converted {nr_file_path} to {obj_file_path}")
-            print(f"Vertices: {len(vertices)}, Faces: {len(indices) // 3}")
+            print(f"Successfully converted {self._nr_file_path} to {obj_file_path}")
+            print(f"Vertices: {len(vertices)}, Faces: {len(faces)}")
             
         except Exception as e:
             print(f"Error converting file: {e}")
@@ -159,14 +204,23 @@ class NR2ObjConverter:
             return False
         
         return True
+    
+    def convert_to_obj(self, nr_file_path, obj_file_path, use_world_space=True, verbose=False):
+        """Convert .nr file to .obj file"""
+        try:
+            return self.load(nr_file_path, verbose) and self.emit_obj(obj_file_path, use_world_space)
+        finally:
+            # Release the file mapping so the .nr file is not held open
+            self.reset()
 
 def main():
     # Check if files were dropped onto the script
     if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
         # Handle drag and drop
+        converter = NR2ObjConverter()
         for file_path in sys.argv[1:]:
             if os.path.isfile(file_path) and file_path.lower().endswith('.nr'):
-                process_file(file_path)
+                process_file(converter, file_path, verbose=True)
             else:
                 print(f"Skipping {file_path}: not a .nr file")
     else:
@@ -187,7 +241,7 @@ def main():
         
         # Process single file or directory
         if input_path.is_file() and input_path.suffix.lower() == '.nr':
-            process_file(input_path, output_dir)
+            process_file(NR2ObjConverter(), input_path, output_dir, verbose=True)
         elif input_path.is_dir():
             nr_files = list(input_path.glob('*.nr')) + list(input_path.glob('*.NR'))
             if not nr_files:
@@ -195,23 +249,39 @@ def main():
                 return
             
             print(f"Found {len(nr_files)} .nr files to convert")
-            for nr_file in nr_files:
-                process_file(nr_file, output_dir)
+            # Files are independent, convert them in parallel, one file per task
+            processes = min(len(nr_files), os.cpu_count() or 1)
+            jobs = [(nr_file, output_dir) for nr_file in nr_files]
+            with Pool(processes=processes, initializer=_init_worker) as pool:
+                # Workers take files in list order, so while they parse, hint the
+                # next file in line into the page cache (shared by all processes)
+                next_file = processes
+                if next_file < len(nr_files):
+                    prefetch_file(nr_files[next_file])
+                for _ in pool.imap_unordered(_process_file_in_worker, jobs, chunksize=1):
+                    next_file += 1
+                    if next_file < len(nr_files):
+                        prefetch_file(nr_files[next_file])
         else:
             print("Input must be a .nr file or a directory containing .nr files")
             return
 
-def process_file(nr_file_path, output_dir=None):
+def process_file(converter, nr_file_path, output_dir=None, verbose=False):
     """Process a single .nr file and generate both Local and World space OBJ files"""
     if output_dir is None:
         output_dir = Path(nr_file_path).parent
     
-    converter = NR2ObjConverter()
+    # Parse the file once, then write both spaces from it
+    print(f"Loading {nr_file_path}...")
+    if not converter.load(nr_file_path, verbose):
+        print("Loading failed")
+        converter.reset()
+        return
     
     # Generate Local space OBJ
     local_output = output_dir / f"{Path(nr_file_path).stem}_Local.obj"
     print(f"Converting {nr_file_path} to Local space...")
-    if converter.convert_to_obj(nr_file_path, local_output, use_world_space=False):
+    if converter.emit_obj(local_output, use_world_space=False):
         print("Local space conversion successful")
     else:
         print("Local space conversion failed")
@@ -219,10 +289,37 @@ def process_file(nr_file_path, output_dir=None):
     # Generate World space OBJ
     world_output = output_dir / f"{Path(nr_file_path).stem}_World.obj"
     print(f"Converting {nr_file_path} to World space...")
-    if converter.convert_to_obj(nr_file_path, world_output, use_world_space=True):
+    if converter.emit_obj(world_output, use_world_space=True):
         print("World space conversion successful")
     else:
         print("World space conversion failed")
+    
+    # Release the file mapping before the converter moves on
+    converter.reset()
+
+# Each pool worker keeps one converter and reuses it for every file it gets
+_worker_converter = None
+
+def _init_worker():
+    global _worker_converter
+    _worker_converter = NR2ObjConverter()
+
+def _process_file_in_worker(job):
+    nr_file_path, output_dir = job
+    process_file(_worker_converter, nr_file_path, output_dir)
+
+def prefetch_file(file_path):
+    """Ask the OS to start reading a file into the page cache without waiting for it"""
+    if not hasattr(os, 'posix_fadvise'):  # Not available on Windows
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass  # Only a hint, the file is read normally either way
 
 if __name__ == "__main__":
     # If no arguments, show help